@@ -1,7 +1,10 @@
+import os
 import time
 import struct
+import threading
 from dataclasses import dataclass
-from typing import Tuple
+from functools import lru_cache
+from typing import List, Tuple
 from .sparx64 import Sparx64
 
 # Constants
@@ -17,6 +20,14 @@ RANDFLAKE_MAX_TIMESTAMP = RANDFLAKE_EPOCH_OFFSET + (1 << RANDFLAKE_TIMESTAMP_BIT
 RANDFLAKE_MAX_NODE = (1 << RANDFLAKE_NODE_BITS) - 1
 RANDFLAKE_MAX_SEQUENCE = (1 << RANDFLAKE_SEQUENCE_BITS) - 1
 
+# Position of the timestamp field in a raw id
+_TS_SHIFT = RANDFLAKE_NODE_BITS + RANDFLAKE_SEQUENCE_BITS
+
+# Ids are handled as unsigned 64-bit values internally and only converted to
+# signed (int64, as in the Go implementation) at the public API boundary.
+_U64_MASK = (1 << 64) - 1
+_SIGN_BIT = 1 << 63
+
 
 # Custom error classes
 class RandflakeError(Exception):
@@ -69,41 +80,91 @@ class ErrInvalidID(RandflakeError):
 
 
 _base32hexchars = "0123456789abcdefghijklmnopqrstuv"
+_base32hexbytes = _base32hexchars.encode("ascii")
 
+# Maps an ASCII byte to its base32hex digit value (either case), 0xFF if the
+# byte is not a digit.
+_base32hexdecodetable = bytearray(b"\xff" * 256)
+for _i, _c in enumerate(_base32hexbytes):
+    _base32hexdecodetable[_c] = _i
+    _base32hexdecodetable[ord(chr(_c).upper())] = _i
+del _i, _c
 
-def _encodeB32hex(n):
-    if n < 0:
-        n += 1 << 64
 
+def _encodeB32hex(n):
+    n &= _U64_MASK
     if n == 0:
         return "0"
 
-    result = ""
+    # A 64-bit value is at most 13 base32 digits, filled from the end.
+    buf = bytearray(13)
+    i = 13
     while n > 0:
-        result = _base32hexchars[n & 0x1F] + result
-        n = n // 32
-    return result
+        i -= 1
+        buf[i] = _base32hexbytes[n & 0x1F]
+        n >>= 5
+    return buf[i:].decode("ascii")
 
 
 def _decodeB32hex(s):
+    tbl = _base32hexdecodetable
     n = 0
-    for c in s:
-        if c == "=":
-            break
-
-        n <<= 5
-        if "0" <= c <= "9":
-            n += ord(c) - ord("0")
-        elif "a" <= c <= "v":
-            n += ord(c) - ord("a") + 10
-        elif "A" <= c <= "V":
-            n += ord(c) - ord("A") + 10
-        else:
+    for c in s.encode("ascii", "replace"):
+        v = tbl[c]
+        if v > 0x1F:
+            if c == 0x3D:  # "="
+                break
             raise ErrInvalidID()
+        n = (n << 5) | v
+
+    return ((n & _U64_MASK) ^ _SIGN_BIT) - _SIGN_BIT
+
+
+@lru_cache(maxsize=32)
+def _batch_structs(count):
+    # Raw ids are packed unsigned; unpacking the ciphertexts as "q" does the
+    # same sign extension as generate().
+    return struct.Struct("<%dQ" % count), struct.Struct("<%dq" % count)
+
+
+# Wall-clock seconds kept fresh by a background thread, for generators created
+# with use_cached_clock=True. Readers just index the list, which is atomic
+# under the GIL.
+_CACHED_CLOCK_INTERVAL = 0.25
+_cached_now_seconds = [0]
+_cached_clock_lock = threading.Lock()
+_cached_clock_thread = None
+
 
-    if n >= 1 << 63:
-        n -= 1 << 64
-    return n
+def _cached_clock_upkeep():
+    while True:
+        time.sleep(_CACHED_CLOCK_INTERVAL)
+        _cached_now_seconds[0] = int(time.time())
+
+
+def _start_cached_clock():
+    global _cached_clock_thread
+    with _cached_clock_lock:
+        if _cached_clock_thread is not None:
+            return
+        _cached_now_seconds[0] = int(time.time())
+        _cached_clock_thread = threading.Thread(
+            target=_cached_clock_upkeep, name="randflake-clock", daemon=True
+        )
+        _cached_clock_thread.start()
+
+
+def _restart_cached_clock_in_child():
+    # The upkeep thread does not survive fork(), restart it in the child.
+    global _cached_clock_thread, _cached_clock_lock
+    _cached_clock_lock = threading.Lock()
+    if _cached_clock_thread is not None:
+        _cached_clock_thread = None
+        _start_cached_clock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_cached_clock_in_child)
 
 
 @dataclass
@@ -114,7 +175,14 @@ class LeaseInfo:
 
 
 class Generator:
-    def __init__(self, node_id: int, lease_start: int, lease_end: int, secret: bytes):
+    def __init__(
+        self,
+        node_id: int,
+        lease_start: int,
+        lease_end: int,
+        secret: bytes,
+        use_cached_clock: bool = False,
+    ):
         if lease_end < lease_start:
             raise ErrInvalidLease()
 
@@ -133,10 +201,27 @@ class Generator:
         self.lease_start = lease_start
         self.lease_end = lease_end
         self.node_id = node_id
+        self._node_shifted = node_id << RANDFLAKE_SEQUENCE_BITS
         self.sequence = 0
         self.rollover = lease_start
         self.sbox = Sparx64(secret)
+        self._lock = threading.Lock()
         self.time_source = None
+        self.use_cached_clock = use_cached_clock
+        if use_cached_clock:
+            _start_cached_clock()
+
+    def __getstate__(self):
+        # Locks can't be pickled or deep-copied; a copy gets its own.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        if self.use_cached_clock:
+            _start_cached_clock()
 
     def update_lease(self, lease_start: int, lease_end: int) -> bool:
         if lease_start != self.lease_start:
@@ -162,55 +247,60 @@ class Generator:
         )
 
     def _new_raw(self) -> int:
-        while True:
-            now = self.time_source() if self.time_source else int(time.time())
-
-            if now < self.lease_start:
-                raise ErrInvalidLease()
+        if self.time_source:
+            now = self.time_source()
+        elif self.use_cached_clock:
+            now = _cached_now_seconds[0]
+        else:
+            now = int(time.time())
 
-            if now > self.lease_end:
-                raise ErrInvalidLease()
+        if not self.lease_start <= now <= self.lease_end:
+            raise ErrInvalidLease()
 
-            self.sequence += 1
-            if self.sequence > RANDFLAKE_MAX_SEQUENCE:
-                if now > self.rollover:
-                    self.rollover = now
-                    self.sequence = 0
-                else:
+        # Defensive: on current GIL builds the read-modify-write below is not
+        # interrupted, but nothing guarantees that for other interpreters or
+        # free-threaded builds. Only the sequence reservation is serialized;
+        # the caller encrypts the raw id outside the lock.
+        with self._lock:
+            self.sequence = sequence = self.sequence + 1
+            if sequence > RANDFLAKE_MAX_SEQUENCE:
+                if now <= self.rollover:
                     if now < self.rollover:
                         raise ErrConsistencyViolation()
                     raise ErrResourceExhausted()
+                self.rollover = now
+                self.sequence = sequence = 0
 
-            timestamp = now - RANDFLAKE_EPOCH_OFFSET
-            return (
-                (timestamp << (RANDFLAKE_NODE_BITS + RANDFLAKE_SEQUENCE_BITS))
-                | (self.node_id << RANDFLAKE_SEQUENCE_BITS)
-                | self.sequence
-            )
+        timestamp = now - RANDFLAKE_EPOCH_OFFSET
+        return (timestamp << _TS_SHIFT) | self._node_shifted | sequence
 
     def generate(self) -> int:
-        id_raw = self._new_raw()
-        src = struct.pack("<q", id_raw)
-        dst = bytearray(8)  # Use bytearray for dst
-        self.sbox.encrypt(dst, src)
-        return struct.unpack("<q", dst)[0]
+        # Branchless sign extension of the unsigned ciphertext
+        return (self.sbox.encrypt_u64(self._new_raw()) ^ _SIGN_BIT) - _SIGN_BIT
+
+    def generate_batch(self, n: int) -> List[int]:
+        # Sequence numbers are reserved one id at a time, exactly as n calls
+        # to generate() would. If that fails partway (ErrResourceExhausted,
+        # lease ended, ...) the error propagates and the sequence numbers
+        # already reserved for this batch are used up; no ids are returned.
+        raws = [self._new_raw() for _ in range(n)]
+        pack, unpack = _batch_structs(len(raws))
+        buf = bytearray(pack.size)
+        pack.pack_into(buf, 0, *raws)
+        self.sbox.encrypt_many(buf, buf)
+        return list(unpack.unpack(buf))
 
     def generate_string(self) -> str:
-        _id = self.generate()
-        return _encodeB32hex(_id)
+        return _encodeB32hex(self.sbox.encrypt_u64(self._new_raw()))
 
     def inspect(self, id_val: int) -> Tuple[int, int, int]:
-        src = struct.pack("<q", id_val)
-        dst = bytearray(8)  # Use bytearray for dst
-        self.sbox.decrypt(dst, src)
-        id_raw = struct.unpack("<q", dst)[0]
+        id_raw = self.sbox.decrypt_u64(id_val)
 
-        if id_raw < 0:
+        # Raw ids never have the sign bit set
+        if id_raw >> 63:
             raise ErrInvalidLease()
 
-        timestamp = (
-            id_raw >> (RANDFLAKE_NODE_BITS + RANDFLAKE_SEQUENCE_BITS)
-        ) + RANDFLAKE_EPOCH_OFFSET
+        timestamp = (id_raw >> _TS_SHIFT) + RANDFLAKE_EPOCH_OFFSET
         node_id = (id_raw >> RANDFLAKE_SEQUENCE_BITS) & RANDFLAKE_MAX_NODE
         sequence = id_raw & RANDFLAKE_MAX_SEQUENCE
 
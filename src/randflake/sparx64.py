@@ -1,7 +1,28 @@
+import struct
+
 _N_STEPS = 8
 _ROUNDS_PER_STEPS = 3
 _N_BRANCHES = 2
 _K_SIZE = 4
+_SUBKEY_SIZE = 2 * _ROUNDS_PER_STEPS
+
+# A 64-bit block as four big-endian 16-bit words
+_BLOCK = struct.Struct(">4H")
+# A 128-bit master key as eight big-endian 16-bit words
+_KEY = struct.Struct(">%dH" % (2 * _K_SIZE))
+
+_U64_MASK = 0xFFFFFFFFFFFFFFFF
+_BYTE_SWAP_MASK = 0x00FF00FF00FF00FF
+
+# 4-way SWAR layout: the same word of four blocks packed into one integer,
+# one 16-bit lane every 32 bits. The zero gap above each lane absorbs the
+# carries of additions and the spill of left rotations, so a single mask
+# keeps the lanes independent.
+_SWAR_WAYS = 4
+_SWAR_LANE_BITS = 32
+_SWAR_ONES = sum(1 << (_SWAR_LANE_BITS * i) for i in range(_SWAR_WAYS))
+_SWAR_MASK = 0xFFFF * _SWAR_ONES
+_SWAR_BLOCKS = struct.Struct(">%dH" % (2 * _N_BRANCHES * _SWAR_WAYS))
 
 
 # Custom error classes
@@ -21,42 +42,15 @@ class ErrInvalidBuffer(SparxError):
         super().__init__("sparx64: src must be 8 bytes (64 bits)")
 
 
-def _rotl(x, n):
-    return ((x << n) | (x >> (16 - n))) & 0xFFFF
-
-
+# 16-bit rotations are written out with their constant shift amounts.
 def _A(l, r):
-    l = _rotl(l, 9)
+    l = ((l << 9) | (l >> 7)) & 0xFFFF
     l = (l + r) & 0xFFFF
-    r = _rotl(r, 2)
-    r ^= l
-    return l, r
-
-
-def _A_inv(l, r):
+    r = ((r << 2) | (r >> 14)) & 0xFFFF
     r ^= l
-    r = _rotl(r, 14)
-    l = (l - r) & 0xFFFF
-    l = _rotl(l, 7)
     return l, r
 
 
-def _L_2(x):
-    tmp = _rotl(x[0] ^ x[1], 8)
-    x[2] ^= x[0] ^ tmp
-    x[3] ^= x[1] ^ tmp
-    x[0], x[2] = x[2], x[0]
-    x[1], x[3] = x[3], x[1]
-
-
-def _L_2_inv(x):
-    x[0], x[2] = x[2], x[0]
-    x[1], x[3] = x[3], x[1]
-    tmp = _rotl(x[0] ^ x[1], 8)
-    x[2] ^= x[0] ^ tmp
-    x[3] ^= x[1] ^ tmp
-
-
 def _K_perm_64_128(k, c):
     k[0], k[1] = _A(k[0], k[1])
     k[2] = (k[2] + k[0]) & 0xFFFF
@@ -69,40 +63,111 @@ def _K_perm_64_128(k, c):
 
 
 def _key_schedule(master_key):
-    subkeys = [
-        [0 for _ in range(2 * _ROUNDS_PER_STEPS)]
-        for _ in range(_N_BRANCHES * _N_STEPS + 1)
-    ]
+    # Subkeys are stored flat: subkey c occupies
+    # [_SUBKEY_SIZE * c, _SUBKEY_SIZE * (c + 1)).
+    subkeys = [0] * (_SUBKEY_SIZE * (_N_BRANCHES * _N_STEPS + 1))
     for c in range(_N_BRANCHES * _N_STEPS + 1):
-        subkeys[c][: 2 * _ROUNDS_PER_STEPS] = master_key[: 2 * _ROUNDS_PER_STEPS]
+        subkeys[_SUBKEY_SIZE * c : _SUBKEY_SIZE * (c + 1)] = master_key[:_SUBKEY_SIZE]
         _K_perm_64_128(master_key, c + 1)
     return subkeys
 
 
-def _sparx_encrypt(x, k):
-    for s in range(_N_STEPS):
-        for b in range(_N_BRANCHES):
-            for r in range(_ROUNDS_PER_STEPS):
-                x[2 * b] ^= k[_N_BRANCHES * s + b][2 * r]
-                x[2 * b + 1] ^= k[_N_BRANCHES * s + b][2 * r + 1]
-                x[2 * b], x[2 * b + 1] = _A(x[2 * b], x[2 * b + 1])
-        _L_2(x)
-    for b in range(_N_BRANCHES):
-        x[2 * b] ^= k[_N_BRANCHES * _N_STEPS][2 * b]
-        x[2 * b + 1] ^= k[_N_BRANCHES * _N_STEPS][2 * b + 1]
-
-
-def _sparx_decrypt(x, k):
-    for b in range(_N_BRANCHES):
-        x[2 * b] ^= k[_N_BRANCHES * _N_STEPS][2 * b]
-        x[2 * b + 1] ^= k[_N_BRANCHES * _N_STEPS][2 * b + 1]
-    for s in range(_N_STEPS - 1, -1, -1):
-        _L_2_inv(x)
-        for b in range(_N_BRANCHES):
-            for r in range(_ROUNDS_PER_STEPS - 1, -1, -1):
-                x[2 * b], x[2 * b + 1] = _A_inv(x[2 * b], x[2 * b + 1])
-                x[2 * b] ^= k[_N_BRANCHES * s + b][2 * r]
-                x[2 * b + 1] ^= k[_N_BRANCHES * s + b][2 * r + 1]
+# Round schedule, precomputed so the hot loops do no index arithmetic: for
+# each step, the subkey offsets of the left and right branch, where each
+# offset is the position of a round's left subkey word in the flat schedule.
+_ENC_SCHEDULE = tuple(
+    tuple(
+        tuple(
+            range(
+                _SUBKEY_SIZE * (_N_BRANCHES * s + b),
+                _SUBKEY_SIZE * (_N_BRANCHES * s + b + 1),
+                2,
+            )
+        )
+        for b in range(_N_BRANCHES)
+    )
+    for s in range(_N_STEPS)
+)
+_DEC_SCHEDULE = tuple(
+    tuple(offsets[::-1] for offsets in step) for step in reversed(_ENC_SCHEDULE)
+)
+# Offset of the final whitening subkey
+_WHITENING = _SUBKEY_SIZE * _N_BRANCHES * _N_STEPS
+
+
+# The round functions take the state as four 16-bit words plus the flat
+# subkey list, and return the new state. They are generated at import time
+# with every round unrolled: subkey indices and rotation amounts become
+# literals, the state lives in four locals, and the branch swap of the linear
+# layer is done by renaming locals instead of moving values.
+_ENC_ROUND = """\
+{l} ^= k[{i}]
+{r} ^= k[{j}]
+{l} = (((({l} << 9) | ({l} >> 7)) & {m}) + {r}) & {m}
+{r} = ((({r} << 2) | ({r} >> 14)) & {m}) ^ {l}
+"""
+_DEC_ROUND = """\
+{r} ^= {l}
+{r} = (({r} << 14) | ({r} >> 2)) & {m}
+{l} = ({l} - {r}) & {m}
+{l} = ((({l} << 7) | ({l} >> 9)) & {m}) ^ k[{i}]
+{r} ^= k[{j}]
+"""
+# x2, x3 ^= L(x0, x1); the branch swap is left to the caller
+_LINEAR_LAYER = """\
+t = {x0} ^ {x1}
+t = ((t << 8) | (t >> 8)) & {m}
+{x2} ^= {x0} ^ t
+{x3} ^= {x1} ^ t
+"""
+
+
+def _sparx_source(name, mask, inverse):
+    m = "0x%X" % mask
+    v = ["x0", "x1", "x2", "x3"]
+    body = []
+
+    def linear_layer():
+        body.append(_LINEAR_LAYER.format(x0=v[0], x1=v[1], x2=v[2], x3=v[3], m=m))
+
+    def rounds(template, step):
+        for b, offsets in enumerate(step):
+            for i in offsets:
+                l, r = v[2 * b], v[2 * b + 1]
+                body.append(template.format(l=l, r=r, i=i, j=i + 1, m=m))
+
+    if not inverse:
+        for step in _ENC_SCHEDULE:
+            rounds(_ENC_ROUND, step)
+            linear_layer()
+            v = [v[2], v[3], v[0], v[1]]
+        whitened = ("%s ^ k[%d]" % (w, _WHITENING + j) for j, w in enumerate(v))
+        body.append("return %s\n" % ", ".join(whitened))
+    else:
+        for j, w in enumerate(v):
+            body.append("%s ^= k[%d]\n" % (w, _WHITENING + j))
+        for step in _DEC_SCHEDULE:
+            v = [v[2], v[3], v[0], v[1]]
+            linear_layer()
+            rounds(_DEC_ROUND, step)
+        body.append("return %s\n" % ", ".join(v))
+
+    lines = "".join(body).splitlines()
+    return "def %s(x0, x1, x2, x3, k):\n    %s\n" % (name, "\n    ".join(lines))
+
+
+def _compile_sparx(name, mask, inverse=False):
+    namespace = {}
+    code = compile(_sparx_source(name, mask, inverse), "<sparx64>", "exec")
+    exec(code, namespace)
+    return namespace[name]
+
+
+_sparx_encrypt = _compile_sparx("_sparx_encrypt", 0xFFFF)
+_sparx_decrypt = _compile_sparx("_sparx_decrypt", 0xFFFF, inverse=True)
+# Same as _sparx_encrypt, on SWAR words with subkeys broadcast to every lane
+# (k[i] * _SWAR_ONES).
+_sparx_encrypt_4way = _compile_sparx("_sparx_encrypt_4way", _SWAR_MASK)
 
 
 class Sparx64:
@@ -110,15 +175,7 @@ class Sparx64:
         if len(key) != 16:
             raise ErrInvalidKey()
 
-        _key = [0] * (2 * _K_SIZE)
-        _key[0] = (key[0] << 8) | key[1]
-        _key[1] = (key[2] << 8) | key[3]
-        _key[2] = (key[4] << 8) | key[5]
-        _key[3] = (key[6] << 8) | key[7]
-        _key[4] = (key[8] << 8) | key[9]
-        _key[5] = (key[10] << 8) | key[11]
-        _key[6] = (key[12] << 8) | key[13]
-        _key[7] = (key[14] << 8) | key[15]
+        _key = list(_KEY.unpack(key))
 
         self.subkeys = _key_schedule(_key)
         for i in range(len(_key)):
@@ -128,48 +185,71 @@ class Sparx64:
         if len(src) != 8 or len(dst) < 8:
             raise ErrInvalidBuffer()
 
-        x = [0] * (2 * _N_BRANCHES)
-        x[0] = (src[0] << 8) | src[1]
-        x[1] = (src[2] << 8) | src[3]
-        x[2] = (src[4] << 8) | src[5]
-        x[3] = (src[6] << 8) | src[7]
-
-        _sparx_encrypt(x, self.subkeys)
-
-        dst[0] = x[0] >> 8
-        dst[1] = x[0] & 0xFF
-        dst[2] = x[1] >> 8
-        dst[3] = x[1] & 0xFF
-        dst[4] = x[2] >> 8
-        dst[5] = x[2] & 0xFF
-        dst[6] = x[3] >> 8
-        dst[7] = x[3] & 0xFF
+        x = _sparx_encrypt(*_BLOCK.unpack_from(src), self.subkeys)
+        _BLOCK.pack_into(dst, 0, *x)
 
     def decrypt(self, dst, src):
         if len(src) != 8 or len(dst) < 8:
             raise ErrInvalidBuffer()
 
-        x = [0] * (2 * _N_BRANCHES)
-        x[0] = (src[0] << 8) | src[1]
-        x[1] = (src[2] << 8) | src[3]
-        x[2] = (src[4] << 8) | src[5]
-        x[3] = (src[6] << 8) | src[7]
-
-        _sparx_decrypt(x, self.subkeys)
+        x = _sparx_decrypt(*_BLOCK.unpack_from(src), self.subkeys)
+        _BLOCK.pack_into(dst, 0, *x)
+
+    def encrypt_u64(self, n):
+        # Encrypts the block holding the little-endian encoding of n, i.e.
+        # the same as encrypt() on n.to_bytes(8, "little"), and returns the
+        # result as an unsigned integer read back in the same byte order.
+        n &= _U64_MASK
+        n = ((n >> 8) & _BYTE_SWAP_MASK) | ((n & _BYTE_SWAP_MASK) << 8)
+        x0, x1, x2, x3 = _sparx_encrypt(
+            n & 0xFFFF, (n >> 16) & 0xFFFF, (n >> 32) & 0xFFFF, n >> 48, self.subkeys
+        )
+
+        n = x0 | (x1 << 16) | (x2 << 32) | (x3 << 48)
+        return ((n >> 8) & _BYTE_SWAP_MASK) | ((n & _BYTE_SWAP_MASK) << 8)
+
+    def decrypt_u64(self, n):
+        # Inverse of encrypt_u64.
+        n &= _U64_MASK
+        n = ((n >> 8) & _BYTE_SWAP_MASK) | ((n & _BYTE_SWAP_MASK) << 8)
+        x0, x1, x2, x3 = _sparx_decrypt(
+            n & 0xFFFF, (n >> 16) & 0xFFFF, (n >> 32) & 0xFFFF, n >> 48, self.subkeys
+        )
+
+        n = x0 | (x1 << 16) | (x2 << 32) | (x3 << 48)
+        return ((n >> 8) & _BYTE_SWAP_MASK) | ((n & _BYTE_SWAP_MASK) << 8)
+
+    def encrypt_many(self, dst, src):
+        if len(src) % 8 != 0 or len(dst) < len(src):
+            raise ErrInvalidBuffer()
 
-        dst[0] = x[0] >> 8
-        dst[1] = x[0] & 0xFF
-        dst[2] = x[1] >> 8
-        dst[3] = x[1] & 0xFF
-        dst[4] = x[2] >> 8
-        dst[5] = x[2] & 0xFF
-        dst[6] = x[3] >> 8
-        dst[7] = x[3] & 0xFF
+        k = self.subkeys
+        n = len(src)
+        width = 8 * _SWAR_WAYS
+        swar_end = n - n % width
+        if swar_end:
+            k4 = [v * _SWAR_ONES for v in k]
+            for off in range(0, swar_end, width):
+                v = _SWAR_BLOCKS.unpack_from(src, off)
+                x = _sparx_encrypt_4way(
+                    v[0] | (v[4] << 32) | (v[8] << 64) | (v[12] << 96),
+                    v[1] | (v[5] << 32) | (v[9] << 64) | (v[13] << 96),
+                    v[2] | (v[6] << 32) | (v[10] << 64) | (v[14] << 96),
+                    v[3] | (v[7] << 32) | (v[11] << 64) | (v[15] << 96),
+                    k4,
+                )
+                _SWAR_BLOCKS.pack_into(
+                    dst,
+                    off,
+                    *[(w >> shift) & 0xFFFF for shift in (0, 32, 64, 96) for w in x],
+                )
+        for off in range(swar_end, n, 8):
+            x = _sparx_encrypt(*_BLOCK.unpack_from(src, off), k)
+            _BLOCK.pack_into(dst, off, *x)
 
     def block_size(self):
         return 8
 
     def destroy(self):
         for i in range(len(self.subkeys)):
-            for j in range(len(self.subkeys[i])):
-                self.subkeys[i][j] = 0
+            self.subkeys[i] = 0
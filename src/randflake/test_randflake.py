@@ -1,7 +1,11 @@
+import copy
 import json
+import pickle
 from pathlib import Path
 import unittest
 import os
+import time
+from . import randflake as _randflake
 from .randflake import (
     Generator,
     RANDFLAKE_EPOCH_OFFSET,
@@ -12,6 +16,10 @@ from .randflake import (
     ErrInvalidSecret,
     ErrInvalidLease,
     ErrInvalidNode,
+    ErrInvalidID,
+    ErrResourceExhausted,
+    ErrConsistencyViolation,
+    _encodeB32hex,
     _decodeB32hex,
 )
 
@@ -156,6 +164,110 @@ class TestRandflake(unittest.TestCase):
             self.assertNotIn(id_val, seen, "Generated duplicate ID")
             seen.add(id_val)
 
+    def test_copy_and_pickle(self):
+        now = RANDFLAKE_EPOCH_OFFSET + 1000
+        g = Generator(1, RANDFLAKE_EPOCH_OFFSET + 1, now + 3600, bytes(16))
+        g.sequence = 41
+
+        for clone in (copy.deepcopy(g), pickle.loads(pickle.dumps(g))):
+            with self.subTest(clone=clone):
+                clone.time_source = lambda: now
+                self.assertEqual(clone.sequence, 41)
+                self.assertEqual(clone.inspect(clone.generate()), (now, 1, 42))
+                self.assertIsNot(clone._lock, g._lock)
+
+    def test_generate_batch(self):
+        secret = bytes(16)
+        now = RANDFLAKE_EPOCH_OFFSET + 1000
+        lease_start = RANDFLAKE_EPOCH_OFFSET + 1
+        lease_end = RANDFLAKE_EPOCH_OFFSET + 3600
+
+        g1 = Generator(1, lease_start, lease_end, secret)
+        g1.time_source = lambda: now
+        g2 = Generator(1, lease_start, lease_end, secret)
+        g2.time_source = lambda: now
+
+        batch = g1.generate_batch(100)
+        self.assertEqual(batch, [g2.generate() for _ in range(100)])
+        self.assertEqual(g1.sequence, g2.sequence)
+        self.assertEqual(g1.generate_batch(0), [])
+
+        # From here on raw ids have the top bit set
+        late = RANDFLAKE_EPOCH_OFFSET + (1 << 29)
+        g1 = Generator(1, late, late + 3600, secret)
+        g1.time_source = lambda: late
+        g2 = Generator(1, late, late + 3600, secret)
+        g2.time_source = lambda: late
+
+        batch = g1.generate_batch(9)
+        self.assertEqual(batch, [g2.generate() for _ in range(9)])
+        self.assertEqual(g1.sequence, g2.sequence)
+
+    def test_generate_batch_exhausted(self):
+        now = RANDFLAKE_EPOCH_OFFSET + 1000
+        clock = [now]
+        g = Generator(1, RANDFLAKE_EPOCH_OFFSET + 1, now + 3600, bytes(16))
+        g.time_source = lambda: clock[0]
+        g.sequence = RANDFLAKE_MAX_SEQUENCE - 2
+        g.rollover = now
+
+        # Two sequence numbers are left in this second; a batch of five fails
+        # and uses both of them up.
+        with self.assertRaises(ErrResourceExhausted):
+            g.generate_batch(5)
+        self.assertEqual(g.sequence, RANDFLAKE_MAX_SEQUENCE + 1)
+        with self.assertRaises(ErrResourceExhausted):
+            g.generate()
+
+        clock[0] = now + 1
+        batch = g.generate_batch(2)
+        self.assertEqual(
+            [g.inspect(id_val) for id_val in batch], [(now + 1, 1, 0), (now + 1, 1, 1)]
+        )
+
+    def test_generate_cached_clock(self):
+        now = int(time.time())
+        g = Generator(1, now - 60, now + 3600, bytes(16), use_cached_clock=True)
+
+        # A cached time inside the lease but clearly not the real time. The
+        # upkeep thread may overwrite it between the write and generate(), in
+        # which case try again.
+        fake_now = now - 30
+        try:
+            for _ in range(10):
+                _randflake._cached_now_seconds[0] = fake_now
+                id_val = g.generate()
+                if _randflake._cached_now_seconds[0] == fake_now:
+                    break
+            else:
+                self.fail("cached clock kept changing under the test")
+        finally:
+            _randflake._cached_now_seconds[0] = int(time.time())
+
+        timestamp, node_id, _ = g.inspect(id_val)
+        self.assertEqual(timestamp, fake_now)
+        self.assertEqual(node_id, 1)
+
+    def test_sequence_rollover(self):
+        now = RANDFLAKE_EPOCH_OFFSET + 1000
+        clock = [now]
+        g = Generator(1, RANDFLAKE_EPOCH_OFFSET + 1, now + 3600, bytes(16))
+        g.time_source = lambda: clock[0]
+        g.sequence = RANDFLAKE_MAX_SEQUENCE - 1
+        g.rollover = now
+
+        self.assertEqual(g.inspect(g.generate()), (now, 1, RANDFLAKE_MAX_SEQUENCE))
+        with self.assertRaises(ErrResourceExhausted):
+            g.generate()
+
+        clock[0] = now + 1
+        self.assertEqual(g.inspect(g.generate()), (now + 1, 1, 0))
+
+        clock[0] = now
+        g.sequence = RANDFLAKE_MAX_SEQUENCE
+        with self.assertRaises(ErrConsistencyViolation):
+            g.generate()
+
     def test_generate_errors(self):
         secret = bytes(16)
         now = RANDFLAKE_EPOCH_OFFSET + 1000
@@ -228,6 +340,26 @@ class TestRandflake(unittest.TestCase):
         self.assertEqual(node_id, 42)
         self.assertEqual(counter, 1)
 
+    def test_encode_b32hex(self):
+        self.assertEqual(_encodeB32hex(0), "0")
+        self.assertEqual(_encodeB32hex(31), "v")
+        self.assertEqual(_encodeB32hex(32), "10")
+        self.assertEqual(_encodeB32hex(4594531474933654033), "3vgoe12ccb8gh")
+        self.assertEqual(_encodeB32hex(-1), "fvvvvvvvvvvvv")
+        self.assertEqual(_decodeB32hex(_encodeB32hex(-1)), -1)
+
+    def test_decode_b32hex(self):
+        self.assertEqual(_decodeB32hex("0"), 0)
+        self.assertEqual(_decodeB32hex("10"), 32)
+        self.assertEqual(_decodeB32hex("3vgoe12ccb8gh"), 4594531474933654033)
+        self.assertEqual(_decodeB32hex("3VGOE12CCB8GH"), 4594531474933654033)
+        self.assertEqual(_decodeB32hex("3vgoe12ccb8gh==="), 4594531474933654033)
+
+        for s in ("w", "3vgoe12ccb8g-", " 1", "\u00e9"):
+            with self.subTest(s=s):
+                with self.assertRaises(ErrInvalidID):
+                    _decodeB32hex(s)
+
     def test_cross_language_test_vectors(self):
         with TEST_VECTOR_PATH.open(encoding="utf-8") as f:
             vectors = json.load(f)
@@ -82,6 +82,46 @@ class TestSparx64(unittest.TestCase):
         with self.assertRaises(ErrInvalidBuffer):
             s.decrypt(bytearray(7), bytes(8))  # Destination too short
 
+    def test_encrypt_u64(self):
+        s = Sparx64(bytes(range(16)))
+        for n in (0, 1, 0x0123456789ABCDEF, 0xFFFFFFFFFFFFFFFF):
+            with self.subTest(n=n):
+                block = bytearray(8)
+                s.encrypt(block, n.to_bytes(8, "little"))
+                self.assertEqual(s.encrypt_u64(n), int.from_bytes(block, "little"))
+
+        self.assertEqual(s.encrypt_u64(-1), s.encrypt_u64(0xFFFFFFFFFFFFFFFF))
+
+    def test_decrypt_u64(self):
+        s = Sparx64(bytes(range(16)))
+        for n in (0, 1, 0x0123456789ABCDEF, 0xFFFFFFFFFFFFFFFF):
+            with self.subTest(n=n):
+                block = bytearray(8)
+                s.decrypt(block, n.to_bytes(8, "little"))
+                self.assertEqual(s.decrypt_u64(n), int.from_bytes(block, "little"))
+                self.assertEqual(s.decrypt_u64(s.encrypt_u64(n)), n)
+
+    def test_encrypt_many(self):
+        s = Sparx64(bytes(range(16)))
+        src = bytes(range(8 * 9))
+        encrypted = bytearray(len(src))
+
+        s.encrypt_many(encrypted, src)
+        for off in range(0, len(src), 8):
+            block = bytearray(8)
+            s.encrypt(block, src[off : off + 8])
+            self.assertEqual(bytes(encrypted[off : off + 8]), bytes(block))
+
+        in_place = bytearray(src)
+        s.encrypt_many(in_place, in_place)
+        self.assertEqual(in_place, encrypted)
+
+        with self.assertRaises(ErrInvalidBuffer):
+            s.encrypt_many(bytearray(16), bytes(12))  # Not a whole number of blocks
+
+        with self.assertRaises(ErrInvalidBuffer):
+            s.encrypt_many(bytearray(8), bytes(16))  # Destination too short
+
     def test_block_size(self):
         key = bytes(
             [
@@ -130,9 +170,8 @@ class TestSparx64(unittest.TestCase):
         s = Sparx64(key)
         s.destroy()
         # Verify all subkeys are zeroed
-        for subkey in s.subkeys:
-            for k in subkey:
-                self.assertEqual(k, 0)
+        for k in s.subkeys:
+            self.assertEqual(k, 0)
 
 
 if __name__ == "__main__":